@@ -0,0 +1,167 @@
+import os
+import json
+import struct
+import hashlib
+
+from deca.ff_adf import GdcArchiveEntry
+import diff
+
+HASH_CHUNK = 1024 * 1024
+DIFF_CACHE_SIZE = 64 * 1024 * 1024
+
+INDEX_MAGIC = b"GDIX"
+INDEX_VERSION = 3
+INDEX_HEADER = struct.Struct("<4sII")
+#index, file offset, offset, size, v_hash, filetype hash, adf type hash, flags, path offset, path length
+INDEX_ENTRY = struct.Struct("<IQQQIIIIII")
+INDEX_HAS_ADF_TYPE = 1
+
+def file_hash(path):
+    #Streamed so hashing never needs the whole file in memory.
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cached_file_hash(hashes_path, path):
+    #Hashing original.gdcc means reading all of it, so the result is remembered together with
+    #the file's size, mtime and inode and reused for as long as those stay the same.
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    identity = [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    try:
+        with open(hashes_path, "r") as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+
+    record = hashes.get(path)
+    if record and record["identity"] == identity:
+        return record["hash"]
+
+    content_hash = file_hash(path)
+    hashes[path] = {"identity": identity, "hash": content_hash}
+    try:
+        os.makedirs(os.path.dirname(hashes_path), exist_ok=True)
+        with open(hashes_path, "w") as f:
+            json.dump(hashes, f)
+    except OSError:
+        pass
+
+    return content_hash
+
+class DiffCache:
+    #On-disk cache of mod diffs, one small json file per mod. Entries are keyed by the mod's
+    #path, size, mtime and inode plus whatever the diff depends on. Like cached_file_hash the
+    #mod is trusted to be unchanged while those are the same, hashing it would take longer than
+    #diffing it. The file mtimes track when an entry was last used and the least recently used
+    #entries are evicted once over max_size.
+    def __init__(self, cache_dir, max_size=DIFF_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def entry_path(self, path, *key):
+        st = os.stat(path)
+        key = json.dumps([os.path.abspath(path), st.st_size, st.st_mtime_ns, st.st_ino] + list(key))
+        return os.path.join(self.cache_dir, hashlib.md5(key.encode("utf-8")).hexdigest() + ".json")
+
+    def lookup(self, path, *key):
+        #Returns the cached value or None, and a token for storing the value on a miss.
+        entry_path = self.entry_path(path, *key)
+        try:
+            with open(entry_path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, entry_path
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return entry["value"], entry_path
+
+    def store(self, token, value):
+        entry_path = token
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(entry_path, "w") as f:
+                json.dump({"value": value}, f)
+        except OSError:
+            #The cache is only an optimization, a read-only app directory just disables it.
+            pass
+
+    def evict(self):
+        #Scans the whole cache directory, so it is called once after a batch of stores rather
+        #than after every one.
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    st = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((st.st_mtime_ns, st.st_size, name))
+
+            total = sum(e[1] for e in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+        except OSError:
+            pass
+
+def store_gdcc_index(index_path, entries):
+    #Compact binary copy of the global.gdcc directory: a header, fixed size entry records and
+    #the v_paths packed after them.
+    records = bytearray(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(entries)))
+    paths = bytearray()
+    for entry in entries:
+        flags = INDEX_HAS_ADF_TYPE if entry.adf_type_hash is not None else 0
+        records += INDEX_ENTRY.pack(entry.index, entry._file_offset, entry.offset, entry.size,
+            entry.v_hash, entry.filetype_hash, entry.adf_type_hash or 0, flags, len(paths), len(entry.v_path))
+        paths += entry.v_path
+
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        temp_path = index_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(records)
+            f.write(paths)
+        os.replace(temp_path, index_path)
+    except OSError:
+        pass
+
+def load_gdcc_index(index_path):
+    #Returns the entries stored by store_gdcc_index, or None if there is no usable index.
+    if not os.path.isfile(index_path):
+        return None
+
+    with diff.map_file(index_path) as index:
+        if len(index) < INDEX_HEADER.size:
+            return None
+
+        magic, version, count = INDEX_HEADER.unpack_from(index)
+        paths_start = INDEX_HEADER.size + count * INDEX_ENTRY.size
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or len(index) < paths_start:
+            return None
+
+        entries = []
+        records = memoryview(index)[INDEX_HEADER.size:paths_start]
+        for (i, file_offset, offset, size, v_hash, filetype_hash, adf_type_hash, flags,
+                path_offset, path_length) in INDEX_ENTRY.iter_unpack(records):
+            path_offset += paths_start
+            entry = GdcArchiveEntry(
+                index=i,
+                offset=offset,
+                size=size,
+                v_hash=v_hash,
+                filetype_hash=filetype_hash,
+                adf_type_hash=adf_type_hash if flags & INDEX_HAS_ADF_TYPE else None,
+                v_path=index[path_offset:path_offset + path_length])
+            entry._file_offset = file_offset
+            entries.append(entry)
+        records.release()
+
+    return entries
@@ -1,6 +1,6 @@
 from typing import List
+import struct
 import numpy as np
-#from numba import njit, jit
 
 
 class FFError(Exception):
@@ -30,17 +30,17 @@ def ff_read(buffer, n_buffer, pos, n):
         return raise_error()
 
 
-def make_read_one(data_type):
-    dt = np.dtype(data_type)
-    ele_size = dt.itemsize
+def make_read_one(fmt):
+    # unpacked in place with a compiled struct, returns a python int or float rather than a numpy scalar
+    st = struct.Struct('<' + fmt)
+    unpack_from = st.unpack_from
+    ele_size = st.size
 
-    #@njit(**params)
     def f(buffer, n_buffer, pos):
         new_pos = pos + ele_size
         if new_pos > n_buffer:
             raise_error()
-        v = np.frombuffer(buffer[pos:new_pos], dtype=dt)
-        return v[0], new_pos
+        return unpack_from(buffer, pos)[0], new_pos
 
     return f
 
@@ -60,16 +60,16 @@ def make_read_many(data_type):
     return f
 
 
-ff_read_u8 = make_read_one(np.uint8)
-ff_read_s8 = make_read_one(np.int8)
-ff_read_u16 = make_read_one(np.uint16)
-ff_read_s16 = make_read_one(np.int16)
-ff_read_u32 = make_read_one(np.uint32)
-ff_read_s32 = make_read_one(np.int32)
-ff_read_u64 = make_read_one(np.uint64)
-ff_read_s64 = make_read_one(np.int64)
-ff_read_f32 = make_read_one(np.float32)
-ff_read_f64 = make_read_one(np.float64)
+ff_read_u8 = make_read_one('B')
+ff_read_s8 = make_read_one('b')
+ff_read_u16 = make_read_one('H')
+ff_read_s16 = make_read_one('h')
+ff_read_u32 = make_read_one('I')
+ff_read_s32 = make_read_one('i')
+ff_read_u64 = make_read_one('Q')
+ff_read_s64 = make_read_one('q')
+ff_read_f32 = make_read_one('f')
+ff_read_f64 = make_read_one('d')
 
 ff_read_u8s = make_read_many(np.uint8)
 ff_read_s8s = make_read_many(np.int8)
@@ -83,9 +83,9 @@ ff_read_f32s = make_read_many(np.float32)
 ff_read_f64s = make_read_many(np.float64)
 
 
-#@njit(**params)
 def ff_read_strz(buffer, n_buffer, pos):
-    pos0 = pos
-    while buffer[pos] != 0 and pos < n_buffer:
-        pos += 1
-    return buffer[pos0:pos], pos
+    # find runs in C, faster than a compiled byte loop once the call overhead is counted
+    end = buffer.find(b'\0', pos, n_buffer)
+    if end < 0:
+        end = n_buffer
+    return buffer[pos:end], end
@@ -11,7 +11,7 @@ from deca.hashes import hash32_func
 #from deca.ff_types import FTYPE_ADF_BARE, FTYPE_ADF0
 #from deca.db_core import VfsDatabase, VfsNode
 
-from .ff_file import ArchiveFile
+from .ff_file import ArchiveFile, ArchiveBuffer
 
 # https://github.com/tim42/gibbed-justcause3-tools-fork/blob/master/Gibbed.JustCause3.FileFormats/AdfFile.cs
 
@@ -897,7 +897,7 @@ class Adf:
 
         header = fp.read(0x40)
 
-        fh = ArchiveFile(io.BytesIO(header))
+        fh = ArchiveBuffer(header)
 
         if len(header) < 0x40:
             raise EDecaErrorParse('File Too Short')
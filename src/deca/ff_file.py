@@ -1,5 +1,21 @@
+import io
 import struct
 
+STRZ_CHUNK = 64
+STRZ_CHUNK_MAX = 64 * 1024
+
+structs = {}
+
+
+def get_struct(fmt, n):
+    # compiled once per format and count, n of None is a single value
+    key = (fmt, n)
+    s = structs.get(key)
+    if s is None:
+        s = struct.Struct(fmt if n is None else fmt * n)
+        structs[key] = s
+    return s
+
 class EDecaOutOfData:
     pass
 
@@ -69,22 +85,24 @@ class ArchiveFile:
         return self.f.write(blk)
 
     def read_strz(self, delim=b'\00'):
-        eof = False
-        r = b''
+        # reads ahead in growing chunks and seeks back to just past the delimiter, most strings
+        # are short so the first chunk is small
+        pos = self.f.tell()
+        buf = bytearray()
+        chunk_size = STRZ_CHUNK
         while True:
-            v = self.f.read(1)
+            searched = max(0, len(buf) - len(delim) + 1)
+            v = self.f.read(chunk_size)
             if len(v) == 0:
-                eof = True
-                break
-            elif v == delim:
-                break
-            else:
-                r = r + v
-
-        if eof:
-            return None
-        else:
-            return r
+                return None
+            buf += v
+
+            idx = buf.find(delim, searched)
+            if idx >= 0:
+                self.f.seek(pos + idx + len(delim))
+                return bytes(buf[:idx])
+
+            chunk_size = min(chunk_size * 2, STRZ_CHUNK_MAX)
 
     def read_base(self, fmt, elen, n, raise_on_no_data):
         if n is None:
@@ -93,14 +111,14 @@ class ArchiveFile:
                 if raise_on_no_data:
                     raise EDecaOutOfData()
                 return None
-            v = struct.unpack(fmt, buf)[0]
+            v = get_struct(fmt, n).unpack(buf)[0]
         else:
             buf = self.f.read(elen * n)
             if len(buf) != elen * n:
                 if raise_on_no_data:
                     raise EDecaOutOfData()
                 return None
-            v = struct.unpack(fmt * n, buf)
+            v = get_struct(fmt, n).unpack(buf)
 
         if self.debug:
             vs = ['{:02x}'.format(t) for t in buf]
@@ -109,8 +127,24 @@ class ArchiveFile:
 
         return v
 
+    def read_bytes(self, n, raise_on_no_data, view=False):
+        # n raw bytes in a single read, view only makes a difference for buffers
+        buf = self.read(n)
+        if len(buf) != n:
+            if raise_on_no_data:
+                raise EDecaOutOfData()
+            return None
+
+        if self.debug:
+            vs = ['{:02x}'.format(t) for t in buf]
+            vs = ''.join(vs)
+            print('{} {}'.format(vs, buf))
+
+        return buf
+
     def read_c8(self, n=None, raise_on_no_data=False):
-        return self.read_base('c', 1, n, raise_on_no_data)
+        # n characters as one bytes object rather than a tuple of single characters
+        return self.read_bytes(1 if n is None else n, raise_on_no_data)
 
     def read_strl_u32(self, n=None, raise_on_no_data=False):
         if n is None:
@@ -122,9 +156,8 @@ class ArchiveFile:
                 sl.append(self.read_strl_u32(raise_on_no_data=raise_on_no_data))
             return sl
 
-    def read_strl(self, n=None, raise_on_no_data=False):
-        v = self.read_base('c', 1, n, raise_on_no_data)
-        return b''.join(v)
+    def read_strl(self, n=None, raise_on_no_data=False, view=False):
+        return self.read_bytes(1 if n is None else n, raise_on_no_data, view)
 
     def read_s8(self, n=None, raise_on_no_data=False):
         return self.read_base('b', 1, n, raise_on_no_data)
@@ -171,11 +204,24 @@ class ArchiveFile:
 
         return None
 
+    def write_bytes(self, v):
+        # bytes like objects are written as they are, lists of single characters are joined first
+        if isinstance(v, list) or isinstance(v, tuple):
+            v = b''.join(v)
+        self.write(v)
+
+        if self.debug:
+            vs = ['{:02x}'.format(t) for t in v]
+            vs = ''.join(vs)
+            print('{} {}'.format(vs, v))
+
+        return None
+
     def write_c8(self, v):
-        return self.write_base('c', 1, v)
+        return self.write_bytes(v)
 
     def write_strl(self, v, n=None):
-        return self.write_base('c', 1, v)
+        return self.write_bytes(v)
 
     def write_s8(self, v):
         return self.write_base('b', 1, v)
@@ -207,3 +253,91 @@ class ArchiveFile:
     def write_f64(self, v):
         return self.write_base('d', 8, v)
 
+
+class ArchiveBuffer(ArchiveFile):
+    # same reading interface as ArchiveFile over bytes, a bytearray or an mmap, fields are unpacked
+    # in place with cached structs instead of a read call and a bytes object per field. the buffer
+    # is exported to a memoryview until exit, an mmap can't be closed before that
+    def __init__(self, buffer, debug=False, endian=None):
+        self.f0 = None
+        self.f = None
+        self.debug = debug
+        self.data = buffer
+        self.buffer = memoryview(buffer)
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        self.buffer.release()
+
+    def seek(self, pos):
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n=None):
+        end = len(self.buffer) if n is None else min(self.pos + n, len(self.buffer))
+        end = max(end, self.pos)
+        v = self.buffer[self.pos:end].tobytes()
+        self.pos = end
+        return v
+
+    def write(self, blk):
+        raise io.UnsupportedOperation('ArchiveBuffer is read only')
+
+    def write_base(self, fmt, elen, v):
+        raise io.UnsupportedOperation('ArchiveBuffer is read only')
+
+    def read_strz(self, delim=b'\00'):
+        idx = self.data.find(delim, self.pos)
+        if idx < 0:
+            self.pos = max(self.pos, len(self.buffer))
+            return None
+
+        v = self.buffer[self.pos:idx].tobytes()
+        self.pos = idx + len(delim)
+        return v
+
+    def read_bytes(self, n, raise_on_no_data, view=False):
+        # with view the result is a memoryview into the buffer, only valid until exit
+        pos = self.pos
+        if n and pos + n > len(self.buffer):
+            self.pos = max(pos, len(self.buffer))
+            if raise_on_no_data:
+                raise EDecaOutOfData()
+            return None
+
+        self.pos = pos + n
+        v = self.buffer[pos:self.pos]
+
+        if self.debug:
+            vs = ['{:02x}'.format(t) for t in v]
+            vs = ''.join(vs)
+            print('{} {}'.format(vs, bytes(v)))
+
+        return v if view else v.tobytes()
+
+    def read_base(self, fmt, elen, n, raise_on_no_data):
+        s = get_struct(fmt, n)
+        pos = self.pos
+        if s.size and pos + s.size > len(self.buffer):
+            # consumed like a short read of a file
+            self.pos = max(pos, len(self.buffer))
+            if raise_on_no_data:
+                raise EDecaOutOfData()
+            return None
+
+        # an empty read past the end is fine, unpack_from would reject the offset
+        v = s.unpack_from(self.buffer, pos) if s.size else ()
+        self.pos = pos + s.size
+
+        if self.debug:
+            vs = ['{:02x}'.format(t) for t in self.buffer[pos:self.pos]]
+            vs = ''.join(vs)
+            print('{} {}'.format(vs, v[0] if n is None else v))
+
+        return v[0] if n is None else v
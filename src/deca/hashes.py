@@ -1,7 +1,7 @@
 import sys
 #import mmh3
 import numpy as np
-#from numba import njit
+from deca.jit import jit
 
 # Need to constrain U32 to only 32 bits using the & 0xffffffff
 # since Python has no native notion of integers limited to 32 bit
@@ -18,12 +18,12 @@ Original copyright notice:
 '''
 
 
-#@njit(inline='always')
+@jit(inline='always')
 def rot(x, k):
     return (x << k) | (x >> (32 - k))
 
 
-#@njit(inline='always')
+@jit(inline='always')
 def mix(a, b, c):
     a &= 0xffffffff; b &= 0xffffffff; c &= 0xffffffff
     a -= c; a &= 0xffffffff; a ^= rot(c,4);  a &= 0xffffffff; c += b; c &= 0xffffffff
@@ -35,7 +35,7 @@ def mix(a, b, c):
     return a, b, c
 
 
-#@njit(inline='always')
+@jit(inline='always')
 def final(a, b, c):
     a &= 0xffffffff; b &= 0xffffffff; c &= 0xffffffff
     c ^= b; c &= 0xffffffff; c -= rot(b,14); c &= 0xffffffff
@@ -48,7 +48,7 @@ def final(a, b, c):
     return a, b, c
 
 
-#@njit(inline='always')
+@jit(inline='always')
 def hashlittle2(data, initval=0, initval2=0):
     length = lenpos = len(data)
 
@@ -86,7 +86,7 @@ def hashlittle2(data, initval=0, initval2=0):
     return c, b
 
 
-#@njit(inline='always')
+@jit(inline='always')
 def hash32_func_bytes(data, init_val=0):
     c, b = hashlittle2(data, init_val, 0)
     return c
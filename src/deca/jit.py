@@ -0,0 +1,18 @@
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# which backend the jit decorated functions run on, 'numba' or 'python'
+backend = 'python' if njit is None else 'numba'
+
+
+def jit(**options):
+    # compiles the function with numba when it is installed and leaves it as plain python otherwise.
+    # compiled code is cached next to the module so only the first run pays for compiling
+    def decorator(f):
+        if njit is None:
+            return f
+        return njit(cache=True, **options)(f)
+
+    return decorator
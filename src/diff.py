@@ -0,0 +1,175 @@
+import os
+import mmap
+import heapq
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+import numpy as np
+
+@contextmanager
+def map_file(path):
+    #Read-only mapping of a whole file, so the page cache backs it instead of a private copy.
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            #Empty files can't be mapped.
+            yield b""
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+def find_changes(original, data, offset=0, size=None):
+    #Offsets into original of all bytes that differ from data placed at offset,
+    #compared up to the shorter of the two and at most size bytes.
+    size = max(min(len(original) - offset, len(data), len(data) if size is None else size), 0)
+    original_bytes = np.frombuffer(original, dtype=np.uint8, count=size, offset=offset)
+    data_bytes = np.frombuffer(data, dtype=np.uint8, count=size)
+
+    #Compared 8 bytes at a time first, mods change little so only the few words that differ are
+    #compared byte by byte. When many differ a plain byte compare is cheaper.
+    words = size // 8
+    original_words = np.frombuffer(original, dtype=np.uint64, count=words, offset=offset)
+    data_words = np.frombuffer(data, dtype=np.uint64, count=words)
+    changed = np.flatnonzero(data_words != original_words)
+    if len(changed) > words // 8:
+        return np.flatnonzero(data_bytes != original_bytes) + offset
+
+    rows, columns = np.nonzero(data_words[changed].view(np.uint8).reshape(-1, 8) !=
+        original_words[changed].view(np.uint8).reshape(-1, 8))
+    tail = np.flatnonzero(data_bytes[words * 8:] != original_bytes[words * 8:]) + words * 8
+    return np.concatenate((changed[rows] * 8 + columns, tail)) + offset
+
+def changed_runs(offsets):
+    #Collapses sorted byte offsets into (start, end) runs, end exclusive.
+    if len(offsets) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(offsets) != 1) + 1
+    starts = np.concatenate(([offsets[0]], offsets[breaks]))
+    ends = np.concatenate((offsets[breaks - 1], [offsets[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def diff_file(original_path, mod_path, offset=0, size=None):
+    #Diffs a mod against the original placed at offset. This is module level so it can
+    #run in a worker process, both files are mapped so workers share the original's pages.
+    with map_file(original_path) as original, map_file(mod_path) as data:
+        offsets = find_changes(original, data, offset, size)
+        return len(data), len(offsets), changed_runs(offsets)
+
+class Extents:
+    #Sorted, non-overlapping (start, end, owner, data) runs of bytes patched over the original gdcc.
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.owners = []
+        self.data = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.owners, self.data)
+
+    def overlapping(self, start, end):
+        #Index range of the extents overlapping [start, end).
+        return bisect_right(self.ends, start), bisect_left(self.starts, end)
+
+    def add(self, start, end, owner, data):
+        #The range must not be owned yet. Neighbours with the same owner are coalesced.
+        i = bisect_left(self.starts, start)
+
+        if i > 0 and self.ends[i - 1] == start and self.owners[i - 1] == owner:
+            i -= 1
+            self.ends[i] = end
+            self.data[i] += data
+        else:
+            self.starts.insert(i, start)
+            self.ends.insert(i, end)
+            self.owners.insert(i, owner)
+            self.data.insert(i, bytearray(data))
+
+        if i + 1 < len(self.starts) and self.starts[i + 1] == end and self.owners[i + 1] == owner:
+            self.ends[i] = self.ends.pop(i + 1)
+            self.data[i] += self.data.pop(i + 1)
+            del self.starts[i + 1]
+            del self.owners[i + 1]
+
+    def apply(self, owner, start, data):
+        #Patches a run of bytes that all differ from the original, returns the owners it conflicts with.
+        #Bytes another mod has already changed to the same value are not conflicts.
+        end = start + len(data)
+
+        conflicts = set()
+        writes = []
+        pos = start
+        lo, hi = self.overlapping(start, end)
+        for k in range(lo, hi):
+            if self.starts[k] > pos:
+                writes.append((pos, self.starts[k]))
+
+            shared_start = max(self.starts[k], start)
+            shared_end = min(self.ends[k], end)
+            patched = self.data[k][shared_start - self.starts[k]:shared_end - self.starts[k]]
+            if data[shared_start - start:shared_end - start] != patched:
+                conflicts.add(self.owners[k])
+
+            pos = self.ends[k]
+
+        if pos < end:
+            writes.append((pos, end))
+
+        for write_start, write_end in writes:
+            self.add(write_start, write_end, owner, data[write_start - start:write_end - start])
+
+        return conflicts
+
+def overlap_matrix(mod_runs):
+    #Sweep over the changed runs of all mods, sorted by start, keeping a heap of the runs
+    #still open. Every pair of mods whose runs overlap gets the number of shared bytes.
+    events = sorted((start, end, owner) for owner, runs in mod_runs.items() for start, end in runs)
+
+    matrix = {owner: {} for owner in mod_runs}
+    active = []
+    for start, end, owner in events:
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+
+        for other_end, other in active:
+            if other != owner:
+                shared = min(end, other_end) - start
+                matrix[owner][other] = matrix[owner].get(other, 0) + shared
+                matrix[other][owner] = matrix[other].get(owner, 0) + shared
+
+        heapq.heappush(active, (end, owner))
+
+    return matrix
+
+class EntryIndex:
+    #Global start/end offsets of the gdcc entries sorted by start, used to map changed runs
+    #back to the entries they touch with a binary search per run.
+    def __init__(self, entries):
+        entries = sorted(entries)
+        self.starts = np.array([e[0] for e in entries], dtype=np.int64)
+        self.ends = np.array([e[1] for e in entries], dtype=np.int64)
+        self.paths = [e[2] for e in entries]
+
+        #Running maximum of the end offsets keeps the search correct even if entries overlap.
+        self.max_ends = np.maximum.accumulate(self.ends) if len(entries) else self.ends
+
+    def overlap(self, start, end):
+        return self.paths_for_runs([(start, end)])
+
+    def paths_for_runs(self, runs):
+        paths = set()
+        if not runs:
+            return paths
+
+        run_starts, run_ends = np.array(runs, dtype=np.int64).T
+        lows = np.searchsorted(self.max_ends, run_starts, side="right")
+        highs = np.searchsorted(self.starts, run_ends, side="left")
+        for start, low, high in zip(run_starts.tolist(), lows.tolist(), highs.tolist()):
+            for i in range(low, high):
+                if self.ends[i] > start:
+                    paths.add(self.paths[i])
+
+        return paths
@@ -0,0 +1,462 @@
+import os
+import sys
+import time
+import queue
+import threading
+
+from tkinter import *
+from tkinter import messagebox
+from tkinter.ttk import *
+
+from merger import *
+import watch
+
+PAD = 5
+PROGRESS_INTERVAL = 100
+#Mod rows added to the tree per after() tick.
+TREE_BATCH = 200
+UNKNOWN_TEXT = "Unknown files not listed in global.gdcc. These will not be merged and can be ignored."
+
+MERGE_OK = """\
+Merged file was written to "%s".
+
+You can now copy this file to "..../theHunterCotW/dropzone/gdc/global.gdcc".
+
+Remember to also set the game launch options if you haven't already!"""
+
+FORCE_MERGE = """\
+!!! WARNING - THERE ARE MOD CONFLICTS !!!
+
+This operation will forcefully merge all mods. When resolving conflicts, a file listed higher in \
+the view listing will win. If you want to change this order, simply rename or create a directory with another name, \
+they are sorted alphabetically (using their full path).
+
+The results of a forced merge may or may not work, depending on how the mods have modified the files. \
+The game may also crash or become unstable.
+
+Are you sure you want to force the merge?"""
+
+class ModMergerApp(Tk):
+    def __init__(self, merger, stats_path=None):
+        super().__init__()
+
+        self.merger = merger
+        #The stats report is written here after every merge and save.
+        self.stats_path = stats_path
+        self.watcher = None
+        self.watch_job = None
+        self.rows = {}
+        self.unknown_rows = None
+        #Children of closed items, only added to the tree when the item is opened.
+        self.lazy_children = {}
+        self.fill_job = None
+
+        #The merge runs in a worker thread, which only talks to the UI through the job queue.
+        self.job = None
+        self.job_done = None
+        self.job_queue = queue.Queue()
+        self.cancel_requested = threading.Event()
+        self.stage = None
+        self.stage_started = 0
+        self.watch_changes = set()
+        self.watch_full = False
+        self.merger.progress = self.merge_progress
+
+        self.frame = Frame(self)
+        self.frame.pack(expand=True, fill=BOTH, padx=PAD, pady=PAD)
+
+        self.create_views(self.frame)
+
+        self.after(1, self.merge_mods)
+
+    def merge_mods(self):
+        if not os.path.isfile(self.merger.original_gdcc):
+            messagebox.showerror("Error", ORIGINAL_MISSING % self.merger.original_gdcc)
+            sys.exit()
+
+        if self.job is not None:
+            #A watch update started first, a full merge follows it instead.
+            self.watch_full = True
+            return
+
+        self.start_job(self.merger.merge, (), self.merge_done)
+
+    def merge_done(self):
+        self.update_tree_view()
+
+        if not self.merger.known_hash():
+            messagebox.showwarning("%s Warning" % self.merger.original_gdcc, HASH_WARNING % self.merger.original_gdcc)
+
+    def start_job(self, target, args, done):
+        #Runs target(*args) in the worker thread, done is called on the UI thread if it finishes.
+        #The merger is only touched by the worker until then, so the buttons stay disabled.
+        for button in (self.merge_button, self.force_button, self.refresh_button):
+            button.configure(state=DISABLED)
+        self.cancel_button.configure(state=NORMAL)
+
+        self.cancel_requested.clear()
+        self.stage = None
+        self.job = threading.Thread(target=self.run_job, args=(target, args), daemon=True)
+        self.job_done = done
+        self.job.start()
+        self.after(PROGRESS_INTERVAL, self.poll_job)
+
+    def run_job(self, target, args):
+        try:
+            target(*args)
+            self.job_queue.put(("done", ))
+        except MergeCancelled:
+            self.job_queue.put(("cancelled", ))
+        except Exception as e:
+            self.job_queue.put(("error", e))
+
+    def merge_progress(self, stage, done, total):
+        #Called on the worker thread.
+        if self.cancel_requested.is_set():
+            raise MergeCancelled()
+        self.job_queue.put(("progress", stage, done, total))
+
+    def poll_job(self):
+        progress = None
+        while True:
+            try:
+                message = self.job_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "progress":
+                #Only the latest progress is shown.
+                progress = message[1:]
+            else:
+                self.job_finished(*message)
+                return
+
+        if progress:
+            self.show_progress(*progress)
+        self.after(PROGRESS_INTERVAL, self.poll_job)
+
+    def show_progress(self, stage, done, total):
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_started = time.monotonic()
+
+        if stage == "Diffing mods" and total:
+            text = "%s: %.1f of %.1f MB" % (stage, done / 1e6, total / 1e6)
+        elif total:
+            text = "%s: %i of %i" % (stage, done, total)
+        elif done:
+            text = "%s: %i files" % (stage, done)
+        else:
+            text = stage
+
+        if total and done:
+            #Estimated from the rate of the current stage so far.
+            elapsed = time.monotonic() - self.stage_started
+            text += ", about %i s left" % (elapsed * (total - done) / done)
+
+        self.progress_bar.configure(mode="determinate", value=100 * done / total if total else 0)
+        self.status.configure(text=text)
+
+    def job_finished(self, result, error=None):
+        self.job = None
+        self.cancel_button.configure(state=DISABLED)
+        self.refresh_button.configure(state=NORMAL)
+        self.progress_bar.configure(value=0)
+        self.status.configure(text="")
+
+        if result == "done":
+            #Before job_done, which may show a dialog. A watch update can start a new job while
+            #the dialog is open, and the buttons must stay disabled until that one finishes.
+            self.update_buttons()
+            self.job_done()
+        elif result == "cancelled":
+            #The merger is left half way, so the next merge has to start over.
+            self.watch_full = True
+            self.status.configure(text="Merge cancelled, press Refresh to merge again.")
+        else:
+            self.watch_full = True
+            messagebox.showerror("Error", "Merging failed: %s" % error)
+
+    def cancel_pressed(self):
+        self.cancel_requested.set()
+        self.cancel_button.configure(state=DISABLED)
+        self.status.configure(text="Cancelling...")
+
+    def update_buttons(self):
+        if self.job is not None:
+            return
+
+        mod_files = self.merger.mod_files
+        button_state = NORMAL if len(mod_files) > 0 else DISABLED
+        self.merge_button.configure(state=button_state)
+
+        force_state = NORMAL if len(mod_files) > 0 and self.merger.merge_state == MERGE_STATE_CONFLICTS else DISABLED
+        self.force_button.configure(state=force_state)
+
+    def create_views(self, root):
+        columns = ("type", "size", )
+        tree = Treeview(root, columns=columns)
+
+        tree.heading('#0', text="File name", anchor="w")
+
+        tree.heading('type', text='Bytes changed', anchor="w")
+        tree.column("type", anchor="w", width=100, stretch=0)
+
+        tree.heading('size', text='File Size', anchor="w")
+        tree.column("size", anchor="w", width=100, stretch=0)
+
+        def item_selected(event):
+            pass
+
+        tree.bind('<<TreeviewSelect>>', item_selected)
+        tree.bind('<<TreeviewOpen>>', self.item_opened)
+        tree.tag_configure("green_fg", foreground="green")
+        tree.tag_configure("red_fg", foreground="red")
+        tree.grid(row=0, column=0, sticky='nsew')
+
+        scrollbar = Scrollbar(root, orient=VERTICAL, command=tree.yview)
+        scrollbar.grid(row=0, column=1, sticky='ns')
+        tree.configure(yscroll=scrollbar.set)
+
+        root.grid_columnconfigure(0, weight=1)
+        root.grid_rowconfigure(0, weight=1)
+
+        button_frame = Frame(root)
+        button_frame.grid(row=1, column=0, padx=PAD, pady=PAD)
+
+        self.merge_button = Button(button_frame, text="Merge Mods", command=self.merge_pressed, width=20)
+        self.merge_button.pack(side=LEFT)
+
+        self.force_button = Button(button_frame, text="Force Merge", command=self.merge_force_pressed, width=20)
+        self.force_button.pack(side=LEFT, padx=PAD)
+
+        self.refresh_button = Button(button_frame, text="Refresh", command=self.refresh_pressed, width=20)
+        self.refresh_button.pack(side=LEFT)
+
+        self.cancel_button = Button(button_frame, text="Cancel", command=self.cancel_pressed, width=20, state=DISABLED)
+        self.cancel_button.pack(side=LEFT, padx=PAD)
+
+        self.watch_var = BooleanVar(value=False)
+        self.watch_button = Checkbutton(button_frame, text="Watch for changes", variable=self.watch_var,
+            command=self.watch_toggled)
+        self.watch_button.pack(side=LEFT, padx=PAD)
+
+        status_frame = Frame(root)
+        status_frame.grid(row=2, column=0, sticky="ew", padx=PAD)
+
+        self.progress_bar = Progressbar(status_frame, orient=HORIZONTAL, length=200, mode="determinate", maximum=100)
+        self.progress_bar.pack(side=LEFT)
+
+        self.status = Label(status_frame, text="")
+        self.status.pack(side=LEFT, padx=PAD)
+
+        self.tree = tree
+
+    def merge_force_pressed(self):
+        if messagebox.askyesno("Force Merge", FORCE_MERGE):
+            self.save_merged(True)
+
+    def merge_pressed(self):
+        self.save_merged(False)
+
+    def save_merged(self, force):
+        #A watch update may have started while the force merge dialog was open, the merger is
+        #only half way until it finishes.
+        if self.job is not None:
+            return
+
+        out_path = os.path.join(OUTPUT_DIR, GLOBAL_GDCC).replace("\\", "/")
+
+        if not force:
+            if self.merger.merge_state != MERGE_STATE_OK:
+                try:
+                    os.remove(out_path)
+                except OSError:
+                    pass
+
+                messagebox.showerror("Merge Failed!", "Remove any errors and conflicts before trying to merge.")
+                return
+
+        #The previous output is updated in place, only the changed patches are written.
+        self.merger.save(out_path, incremental=True)
+        self.write_stats()
+
+        messagebox.showinfo("Merge Successful!", MERGE_OK % out_path)
+
+    def refresh_pressed(self):
+        self.clear_tree()
+        self.after(1, self.merge_mods)
+
+    def watch_toggled(self):
+        if self.watch_job:
+            self.after_cancel(self.watch_job)
+            self.watch_job = None
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+
+        if self.watch_var.get():
+            #Changes made before the watch started are picked up by a full merge.
+            self.watcher = watch.create_watcher(self.merger.mod_dir)
+            self.watch_changes = set()
+            self.watch_full = True
+            self.watch_job = self.after(1, self.watch_mods)
+
+    def watch_mods(self):
+        #Only the mods that changed are merged again and only their rows are updated. Changes
+        #found while a merge is running are merged after it.
+        self.watch_job = self.after(int(watch.WATCH_INTERVAL * 1000), self.watch_mods)
+
+        changes = self.watcher.poll()
+        if changes is None:
+            self.watch_full = True
+        else:
+            self.watch_changes.update(changes)
+
+        if self.job is None and (self.watch_full or self.watch_changes):
+            changes = None if self.watch_full else self.watch_changes
+            self.watch_changes = set()
+            self.watch_full = False
+            self.start_job(self.merger.update_changed, (changes, ), self.update_tree_view)
+
+    def clear_tree(self):
+        self.cancel_fill()
+        self.tree.delete(*self.tree.get_children())
+        self.rows = {}
+        self.unknown_rows = None
+        self.lazy_children = {}
+
+    def cancel_fill(self):
+        if self.fill_job:
+            self.after_cancel(self.fill_job)
+            self.fill_job = None
+
+    def update_tree_view(self):
+        #Rows are keyed by the file path and only rewritten when their contents changed, so merging
+        #again after a few mods changed doesn't rebuild the whole view. The rows are filled in
+        #batches across after() ticks so the UI keeps responding for any number of mods.
+        self.cancel_fill()
+
+        merger = self.merger
+        if not merger.mod_files and not merger.unknown_files:
+            self.clear_tree()
+            self.tree.insert("", END, text="No files found. Place them inside the '%s' directory." % merger.mod_dir)
+            self.fill_done()
+            return
+
+        with merger.stats.stage("tree"):
+            if not self.tree.exists("root"):
+                self.clear_tree()
+                self.tree.insert("", END, iid="root", text="Modded files", open=True)
+
+            unknown_rows = [f.file_path for f in merger.unknown_files]
+            if unknown_rows != self.unknown_rows:
+                if self.tree.exists("unknown"):
+                    self.tree.delete("unknown")
+                if merger.unknown_files:
+                    self.insert_lazy("", 0, "unknown", UNKNOWN_TEXT, [],
+                        [self.merger.trim_path(f.file_path) for f in merger.unknown_files], [])
+                self.unknown_rows = unknown_rows
+
+            rows = [(f.file_path, self.mod_row(f)) for f in merger.mod_files]
+            paths = set(path for path, row in rows)
+            stale = [path for path in self.rows if path not in paths]
+            for path in stale:
+                self.delete_mod_row(path)
+
+        self.fill_rows(rows, 0)
+
+    def fill_rows(self, rows, start):
+        #Rows before start are already in place, the rest of the old rows are still after them.
+        end = min(start + TREE_BATCH, len(rows))
+        with self.merger.stats.stage("tree"):
+            for index in range(start, end):
+                path, row = rows[index]
+                if self.rows.get(path) == row:
+                    self.tree.move(path, "root", index)
+                    continue
+
+                is_open = False
+                if self.tree.exists(path):
+                    is_open = self.tree.item(path, "open")
+                    self.delete_mod_row(path)
+                self.insert_mod_row(path, index, row, is_open)
+                self.rows[path] = row
+
+        if end < len(rows):
+            self.fill_job = self.after(1, self.fill_rows, rows, end)
+        else:
+            self.fill_done()
+
+    def fill_done(self):
+        self.fill_job = None
+        self.status.configure(text="Merged %i mods in %s" % (len(self.merger.mod_files), self.merger.stats.summary()))
+        self.write_stats()
+
+    def write_stats(self):
+        if self.stats_path:
+            self.merger.stats.write_report(self.stats_path)
+
+    def delete_mod_row(self, path):
+        if self.tree.exists(path):
+            self.tree.delete(path)
+        self.rows.pop(path, None)
+        self.lazy_children.pop(self.changed_iid(path), None)
+
+    def changed_iid(self, path):
+        return "changed:" + path
+
+    def insert_lazy(self, parent, index, iid, text, tags, children, child_tags):
+        #The placeholder child only makes the item expandable.
+        self.tree.insert(parent, index, iid=iid, text=text, tags=tags, open=False)
+        self.tree.insert(iid, END, text="...", tags=child_tags)
+        self.lazy_children[iid] = (children, child_tags)
+
+    def item_opened(self, event):
+        iid = self.tree.focus()
+        if iid not in self.lazy_children:
+            return
+
+        children, tags = self.lazy_children.pop(iid)
+        self.tree.delete(*self.tree.get_children(iid))
+        for text in children:
+            self.tree.insert(iid, END, text=text, tags=tags)
+
+    def mod_row(self, f):
+        #Everything shown for a mod, rows are only rewritten when this changes.
+        info = self.merger.file_info.get(f.file_path)
+        changed = ""
+        size = ""
+        error = ""
+        color = "green_fg"
+        conflicts = ()
+        overlaps = ()
+        files_changed = ()
+        if info:
+            changed = str(info["changed"])
+            size = str(info["file_size"])
+            error = info.get("error")
+            if info["conflicts"] or error:
+                color = "red_fg"
+            conflicts = tuple(sorted(info["conflicts"]))
+            overlaps = tuple(sorted(info["overlaps"].items()))
+            files_changed = tuple(sorted(info["files_changed"]))
+
+        return (self.merger.trim_path(f.file_path), changed, size, color, error, conflicts, overlaps, files_changed)
+
+    def insert_mod_row(self, iid, index, row, is_open):
+        text, changed, size, color, error, conflicts, overlaps, files_changed = row
+        self.tree.insert("root", index, iid=iid, text=text, values=(changed, size), tags=[color], open=is_open)
+
+        if error:
+            self.tree.insert(iid, END, text="Error: %s" % error, tags=["red_fg"])
+
+        for clash in conflicts:
+            self.tree.insert(iid, END, text="Conflicts with: %s" % self.merger.trim_path(clash), tags=["red_fg"])
+
+        for other, shared in overlaps:
+            text = "Overlaps with: %s (%i bytes)" % (self.merger.trim_path(other), shared)
+            self.tree.insert(iid, END, text=text, tags=[color])
+
+        if files_changed:
+            self.insert_lazy(iid, END, self.changed_iid(iid), "Changed files in global.gdcc", [color], files_changed, [color])
@@ -0,0 +1,382 @@
+import os
+import time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from deca import ff_file, ff_adf
+import diff
+import cache
+import output
+import patch
+import stats
+
+APP_PATH = os.path.dirname(os.path.realpath(__file__))
+
+GLOBAL_GDCC = "global.gdcc"
+ORIGINAL_GDCC = os.path.join(APP_PATH, "original.gdcc")
+MOD_DIR = os.path.abspath(os.path.join(APP_PATH, "../mods"))
+OUTPUT_DIR = os.path.abspath(os.path.join(APP_PATH, "../output"))
+CACHE_DIR = os.path.join(APP_PATH, "cache")
+
+KNOWN_GDCC_HASHES = [
+    "59baa86577fbcbeeb5b401738b1a9c04", #Revontuli update (28 June 2022)
+]
+
+ORIGINAL_MISSING = 'You must place an UNMODIFIED "%s" in the app directory.'
+
+HASH_WARNING = """\
+The content hash of "%s" does not match any known files.
+
+This is probably fine, but make sure the files and this program is up-to-date."""
+
+MERGE_STATE_OK = 1
+MERGE_STATE_CONFLICTS = 2
+MERGE_STATE_ERROR = 3
+
+class MergeCancelled(Exception):
+    pass
+
+class ModFile:
+    def __init__(self, name, file_path, gdcc_path):
+        self.name = name
+        self.file_path = file_path
+        self.gdcc_path = gdcc_path
+
+def sort_mod_files(files):
+    return sorted(files, key=lambda f: f.file_path.lower())
+
+class ModMerger:
+    #Scans, diffs and merges the mods against original.gdcc. Has no UI of its own so it
+    #can be driven by the Tk app or the headless command line.
+    def __init__(self, original_gdcc=ORIGINAL_GDCC, mod_dir=MOD_DIR, jobs=1, cache_dir=CACHE_DIR):
+        self.original_gdcc = os.path.abspath(original_gdcc)
+        self.mod_dir = os.path.abspath(mod_dir)
+        #Number of processes diffing global.gdcc mods, 0 uses all cores.
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.diff_cache = cache.DiffCache(os.path.join(cache_dir, "diffs")) if cache_dir else None
+
+        self.mod_files = []
+        self.unknown_files = []
+        self.file_info = {}
+        self.overlaps = {}
+        self.extents = diff.Extents()
+        self.diffs = {}
+        self.gdcc_hash = None
+        self.original_size = 0
+        self.merge_state = MERGE_STATE_OK
+        #Called with (stage, done, total) while merging, raising MergeCancelled from it stops the merge.
+        self.progress = None
+        self.stats = stats.Stats()
+        self.diffed = 0
+        self.diff_total = 0
+
+    def merge(self):
+        #The original and the mods are only mapped, the merge result is kept as patches over the original.
+        self.stats = stats.Stats()
+        with diff.map_file(self.original_gdcc) as original_gdcc:
+            self.report("Hashing original.gdcc")
+            with self.stats.stage("hash original"):
+                self.gdcc_hash = self.original_hash()
+                self.original_size = len(original_gdcc)
+
+            self.report("Reading global.gdcc")
+            with self.stats.stage("read global.gdcc"):
+                entries = self.load_gdcc_entries(original_gdcc)
+            with self.stats.stage("gdcc files"):
+                self.file_paths, self.entry_index = self.get_gdcc_files(entries)
+
+        with self.stats.stage("find mod files"):
+            self.mod_files, self.unknown_files = self.find_mod_files()
+        with self.stats.stage("diff"):
+            self.diffs = self.diff_mod_files(self.mod_files)
+        with self.stats.stage("merge"):
+            self.assemble()
+
+    def update(self, paths):
+        #Merges again after the given files or directories were added, changed or removed. Only
+        #the mods under those paths are diffed again, the others keep their diff results.
+        self.stats = stats.Stats()
+        paths = set(path.replace("\\", "/").rstrip("/") for path in paths)
+
+        def touched(file_path):
+            return any(file_path == path or file_path.startswith(path + "/") for path in paths)
+
+        with self.stats.stage("find mod files"):
+            mod_files = [f for f in self.mod_files if not touched(f.file_path)]
+            unknown = [f for f in self.unknown_files if not touched(f.file_path)]
+            for path in paths:
+                if os.path.isdir(path):
+                    found_files, found_unknown = self.find_mod_files(path)
+                    mod_files.extend(found_files)
+                    unknown.extend(found_unknown)
+                elif os.path.isfile(path):
+                    mod_file, known = self.classify(path)
+                    (mod_files if known else unknown).append(mod_file)
+
+            #A path can be listed along with its directory.
+            self.mod_files = sort_mod_files({f.file_path: f for f in mod_files}.values())
+            self.unknown_files = sort_mod_files({f.file_path: f for f in unknown}.values())
+
+        with self.stats.stage("diff"):
+            self.diffs = {path: d for path, d in self.diffs.items() if not touched(path)}
+            self.diffs.update(self.diff_mod_files([f for f in self.mod_files if f.file_path not in self.diffs]))
+        with self.stats.stage("merge"):
+            self.assemble()
+
+    def report(self, stage, done=0, total=0):
+        if self.progress:
+            self.progress(stage, done, total)
+
+    def update_changed(self, changes):
+        #changes are the paths reported by a watch.create_watcher watcher, None if anything may have changed.
+        if changes is not None:
+            try:
+                self.update(changes)
+                return
+            except OSError:
+                #Usually a file removed again while it was read, a full merge sorts it out.
+                pass
+
+        self.merge()
+
+    def assemble(self):
+        #Applies the diffed mods in priority order. This only reads the changed runs of each mod.
+        self.extents = diff.Extents()
+        self.file_info = {}
+        for i, mod_file in enumerate(self.merge_order(self.mod_files)):
+            self.report("Merging", i, len(self.mod_files))
+            offset, error, result = self.diffs[mod_file.file_path]
+            self.file_info[mod_file.file_path] = self.merge_mod(mod_file, offset, result, error, self.extents)
+
+        self.overlaps = diff.overlap_matrix({path: info["runs"] for path, info in self.file_info.items()})
+        for path, info in self.file_info.items():
+            info["overlaps"] = self.overlaps[path]
+
+        self.merge_state = MERGE_STATE_OK
+        for item in self.file_info.values():
+            if item["error"]:
+                #Serious error, bail out.
+                self.merge_state = MERGE_STATE_ERROR
+                break
+            elif item["conflicts"]:
+                self.merge_state = MERGE_STATE_CONFLICTS
+
+    def original_hash(self):
+        if self.cache_dir:
+            return cache.cached_file_hash(os.path.join(self.cache_dir, "hashes.json"), self.original_gdcc)
+        return cache.file_hash(self.original_gdcc)
+
+    def known_hash(self):
+        return self.gdcc_hash in KNOWN_GDCC_HASHES
+
+    def read_global_gdcc(self, original_gdcc):
+        #Parsed straight from the mapping, without a read call per field.
+        adf = ff_adf.Adf()
+        with ff_file.ArchiveBuffer(original_gdcc) as archive:
+            adf.deserialize(archive)
+        return adf
+
+    def load_gdcc_entries(self, original_gdcc):
+        #The parsed directory of a given original.gdcc never changes, so it is kept in a binary
+        #index keyed by the content hash and the ADF is only parsed the first time.
+        index_path = None
+        if self.cache_dir:
+            index_path = os.path.join(self.cache_dir, "index", self.gdcc_hash + ".idx")
+            entries = cache.load_gdcc_index(index_path)
+            if entries is not None:
+                return entries
+
+        entries = self.read_gdcc_entries(self.read_global_gdcc(original_gdcc))
+        if index_path:
+            cache.store_gdcc_index(index_path, entries)
+        return entries
+
+    def read_gdcc_entries(self, adf):
+        entries = []
+        for i, instance in enumerate(adf.table_instance_values):
+            for item in instance:
+                item._file_offset = adf.table_instance[i].offset
+                entries.append(item)
+        return entries
+
+    def get_gdcc_files(self, gdcc_entries):
+        files = {}
+        entries = []
+        for item in gdcc_entries:
+            path = str(item.v_path, "ascii")
+            if path in files:
+                raise Exception("Duplicate file %s" % path)
+            files[path] = item
+
+            global_offset = item._file_offset + item.offset
+            entries.append((global_offset, global_offset + item.size, path))
+
+        return files, diff.EntryIndex(entries)
+
+    def find_mod_files(self, path=None):
+        mod_files = []
+        unknown = []
+        for root, dirs, files in os.walk(path or self.mod_dir):
+            for name in files:
+                mod_file, known = self.classify(os.path.join(root, name))
+                (mod_files if known else unknown).append(mod_file)
+                self.report("Scanning mods", len(mod_files) + len(unknown))
+
+        return sort_mod_files(mod_files), sort_mod_files(unknown)
+
+    def classify(self, file_path):
+        #Returns the ModFile and whether it is merged, files that aren't in global.gdcc are unknown.
+        file_path = file_path.replace("\\", "/")
+        name = os.path.basename(file_path)
+        gdcc_path = file_path.split("dropzone/")[-1]
+
+        if name == GLOBAL_GDCC or gdcc_path in self.file_paths:
+            return ModFile(name, file_path, gdcc_path), True
+        return ModFile(name, file_path, ""), False
+
+    def diff_mods(self, mod_files, offsets, sizes):
+        #Diffs each mod against the original placed at its offset, reusing cached results of
+        #unchanged mods. Results come back in the same order as mod_files.
+        results = [None] * len(mod_files)
+        tokens = {}
+        for i, mod_file in enumerate(mod_files):
+            if self.diff_cache:
+                cached, tokens[i] = self.diff_cache.lookup(mod_file.file_path, self.gdcc_hash, offsets[i], sizes[i])
+                if cached:
+                    file_size, changed, runs, files_changed = cached
+                    results[i] = (file_size, changed, [tuple(r) for r in runs], set(files_changed))
+                    self.stats.mod(mod_file.file_path, size=file_size, cached=True)
+                    self.report_diffed(file_size)
+
+        todo = [i for i, result in enumerate(results) if result is None]
+        paths = [mod_files[i].file_path for i in todo]
+        todo_offsets = [offsets[i] for i in todo]
+        todo_sizes = [sizes[i] for i in todo]
+
+        jobs = min(self.jobs or os.cpu_count() or 1, len(todo))
+        if jobs > 1:
+            #Workers map the original themselves, the results come back in priority order.
+            with ProcessPoolExecutor(jobs) as pool:
+                try:
+                    self.store_diffs(results, todo, paths, tokens, pool.map(stats.timed, repeat(diff.diff_file),
+                        repeat(self.original_gdcc), paths, todo_offsets, todo_sizes))
+                except BaseException:
+                    #Only the diffs already running are waited for.
+                    pool.shutdown(cancel_futures=True)
+                    raise
+        else:
+            self.store_diffs(results, todo, paths, tokens, map(stats.timed, repeat(diff.diff_file),
+                repeat(self.original_gdcc), paths, todo_offsets, todo_sizes))
+
+        if self.diff_cache and todo:
+            self.diff_cache.evict()
+        return results
+
+    def store_diffs(self, results, todo, paths, tokens, diffs):
+        for i, path, ((file_size, changed, runs), wall, cpu) in zip(todo, paths, diffs):
+            self.stats.mod(path, size=file_size, cached=False, diff_wall=wall, diff_cpu=cpu)
+            files_changed = self.entry_index.paths_for_runs(runs)
+            results[i] = (file_size, changed, runs, files_changed)
+            if self.diff_cache:
+                self.diff_cache.store(tokens[i], [file_size, changed, runs, sorted(files_changed)])
+            self.report_diffed(file_size)
+
+    def report_diffed(self, size):
+        self.diffed += size
+        self.report("Diffing mods", self.diffed, self.diff_total)
+
+    def diff_mod_files(self, mod_files):
+        #Returns the offset, error and diff result of each mod by file path.
+        self.diffed = 0
+        self.diff_total = sum(os.path.getsize(f.file_path) for f in mod_files)
+        self.report("Diffing mods", 0, self.diff_total)
+
+        diffs = {}
+        diffs.update(self.diff_gdccs([f for f in mod_files if f.name == GLOBAL_GDCC]))
+        diffs.update(self.diff_loose_files([f for f in mod_files if f.name != GLOBAL_GDCC]))
+        return diffs
+
+    def merge_order(self, mod_files):
+        #Whole global.gdcc mods come first, then the loose files grouped by the file they replace.
+        file_groups = {}
+        for mod_file in [f for f in mod_files if f.name != GLOBAL_GDCC]:
+            if mod_file.gdcc_path in file_groups:
+                file_groups[mod_file.gdcc_path].append(mod_file)
+            else:
+                file_groups[mod_file.gdcc_path] = [mod_file]
+
+        ordered = [f for f in mod_files if f.name == GLOBAL_GDCC]
+        for path_group in file_groups.values():
+            ordered.extend(sort_mod_files(path_group))
+        return ordered
+
+    def diff_gdccs(self, gdccs):
+        results = self.diff_mods(gdccs, [0] * len(gdccs), [None] * len(gdccs))
+
+        diffs = {}
+        for gd, result in zip(gdccs, results):
+            error = ""
+            if result[0] != self.original_size:
+                error = "File size does not match, should be %i" % self.original_size
+
+            diffs[gd.file_path] = (0, error, result)
+
+        return diffs
+
+    def diff_loose_files(self, mod_files):
+        #Each loose file is compared against its own entry's slice of original.gdcc. A file that is
+        #identical to its entry is just a diff without changes, comparing it is cheaper than hashing it.
+        entries = [self.file_paths[f.gdcc_path] for f in mod_files]
+        offsets = [int(entry.offset + entry._file_offset) for entry in entries]
+        results = self.diff_mods(mod_files, offsets, [int(entry.size) for entry in entries])
+
+        diffs = {}
+        for mod_file, entry, offset, result in zip(mod_files, entries, offsets, results):
+            error = ""
+            if result[0] != entry.size:
+                error = "File size does not match global.gdcc entry size, should be %i" % entry.size
+
+            diffs[mod_file.file_path] = (offset, error, result)
+
+        return diffs
+
+    def merge_mod(self, mod_file, offset, result, error, extents):
+        file_size, changed, runs, files_changed = result
+
+        info = {
+            "changed": changed,
+            "conflicts": set(),
+            "file_size": file_size,
+            "error": error,
+            "files_changed": files_changed,
+            "runs": runs,
+        }
+
+        #Only the changed runs are read from the mod, as whole runs.
+        started = time.perf_counter()
+        with diff.map_file(mod_file.file_path) as contents:
+            for start, end in runs:
+                conflicts = extents.apply(mod_file.file_path, start, contents[start - offset:end - offset])
+                info["conflicts"].update(conflicts)
+        self.stats.mod(mod_file.file_path, merge_wall=time.perf_counter() - started)
+
+        return info
+
+    def trim_path(self, path):
+        mods_path = self.mod_dir.replace("\\", "/") + "/"
+        path = path.replace("\\", "/")
+        if path.startswith(mods_path):
+            path = path.replace(mods_path, "", 1)
+        return path
+
+    def save(self, out_path, incremental=False):
+        #Returns the number of bytes written.
+        with self.stats.stage("save"):
+            return output.save_patched(self.original_gdcc, out_path, self.extents, self.gdcc_hash, incremental)
+
+    def save_patch(self, patch_path, compress=False):
+        #Writes only the merged changes, see patch.apply_patch. Returns the size of the patch.
+        with self.stats.stage("save patch"):
+            return patch.write_patch(patch_path, self.extents, self.gdcc_hash, os.path.getsize(self.original_gdcc),
+                compress)
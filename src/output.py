@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+
+COPY_CHUNK = 1024 * 1024
+MANIFEST_SUFFIX = ".manifest"
+
+def copy_range(src, dst, offset, count):
+    #Copies count bytes at offset from src to the same offset in dst, both file objects. The
+    #copy stays in the kernel where the platform allows it and falls back to buffered copying.
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    end = offset + count
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(src_fd, dst_fd, end - offset, offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+            return
+        except OSError:
+            #Not supported between these file systems, copy the rest another way.
+            pass
+
+    if hasattr(os, "sendfile"):
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            while offset < end:
+                copied = os.sendfile(dst_fd, src_fd, offset, end - offset)
+                if copied == 0:
+                    break
+                offset += copied
+            return
+        except OSError:
+            pass
+
+    src.seek(offset)
+    while offset < end:
+        chunk = src.read(min(COPY_CHUNK, end - offset))
+        if not chunk:
+            break
+        write_at(dst, offset, chunk)
+        offset += len(chunk)
+
+def write_at(dst, offset, data):
+    #dst is unbuffered, so a single write may be partial.
+    with memoryview(data) as view:
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(dst.fileno(), view, offset)
+            else:
+                dst.seek(offset)
+                written = dst.write(view)
+            view = view[written:]
+            offset += written
+
+def write_patched(original_path, out_path, extents):
+    #Writes the original with the extents patched over it. Only the patches are written from
+    #memory, the unchanged ranges in between are copied from the original. The result is written
+    #to a temporary file first so out_path is either the old or the complete new file.
+    out_dir = os.path.dirname(out_path)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    temp_path = out_path + ".tmp"
+    try:
+        #Unbuffered, the kernel copies and the patch writes go through the same descriptor.
+        with open(original_path, "rb") as src, open(temp_path, "wb", buffering=0) as dst:
+            size = os.fstat(src.fileno()).st_size
+            position = 0
+            for start, end, owner, data in extents:
+                if start > position:
+                    copy_range(src, dst, position, start - position)
+                write_at(dst, start, data)
+                position = end
+
+            if size > position:
+                copy_range(src, dst, position, size - position)
+
+        os.replace(temp_path, out_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    return size
+
+def subtract_ranges(ranges, cover):
+    #The parts of the sorted (start, end) ranges that are not inside any of the sorted cover ranges.
+    result = []
+    i = 0
+    for start, end in ranges:
+        while i < len(cover) and cover[i][1] <= start:
+            i += 1
+
+        j = i
+        while start < end and j < len(cover) and cover[j][0] < end:
+            if cover[j][0] > start:
+                result.append((start, cover[j][0]))
+            start = max(start, cover[j][1])
+            j += 1
+
+        if start < end:
+            result.append((start, end))
+
+    return result
+
+def update_patched(original_path, out_path, extents, written_extents):
+    #Updates a file written from the same original in place. written_extents are the
+    #(start, end, digest) patches it currently has, patches that are still the same are left
+    #alone, the others are reverted to the original unless a new patch covers them.
+    new_extents = [(start, end, hashlib.md5(data).hexdigest(), data) for start, end, owner, data in extents]
+    kept = set(tuple(e) for e in written_extents) & set(e[:3] for e in new_extents)
+
+    reverts = subtract_ranges(sorted(tuple(e[:2]) for e in written_extents if tuple(e) not in kept),
+        [e[:2] for e in new_extents])
+    patches = [e for e in new_extents if e[:3] not in kept]
+
+    written = 0
+    with open(original_path, "rb") as src, open(out_path, "r+b", buffering=0) as dst:
+        for start, end in reverts:
+            copy_range(src, dst, start, end - start)
+            written += end - start
+
+        for start, end, digest, data in patches:
+            write_at(dst, start, data)
+            written += end - start
+
+    return written
+
+def load_manifest(out_path, baseline):
+    #The manifest lists the patches in out_path, it is only valid for an output written from the
+    #same original that hasn't been touched since.
+    try:
+        with open(out_path + MANIFEST_SUFFIX, "r") as f:
+            manifest = json.load(f)
+        st = os.stat(out_path)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("baseline") != baseline or manifest.get("identity") != [st.st_size, st.st_mtime_ns]:
+        return None
+    return manifest
+
+def store_manifest(out_path, baseline, extents):
+    st = os.stat(out_path)
+    manifest = {
+        "baseline": baseline,
+        "identity": [st.st_size, st.st_mtime_ns],
+        "extents": [[start, end, hashlib.md5(data).hexdigest(), owner] for start, end, owner, data in extents],
+    }
+    try:
+        with open(out_path + MANIFEST_SUFFIX, "w") as f:
+            json.dump(manifest, f)
+    except OSError:
+        pass
+
+def remove_manifest(out_path):
+    try:
+        os.remove(out_path + MANIFEST_SUFFIX)
+    except OSError:
+        pass
+
+def save_patched(original_path, out_path, extents, baseline, incremental=False):
+    #Writes the merged file and returns the number of bytes written. Incremental saves update an
+    #output with a valid manifest in place and only write the ranges that changed since.
+    manifest = load_manifest(out_path, baseline) if incremental else None
+
+    #The in-place update isn't atomic, without a manifest an interrupted update is just rewritten.
+    remove_manifest(out_path)
+    if manifest is None:
+        written = write_patched(original_path, out_path, extents)
+    else:
+        written = update_patched(original_path, out_path, extents, [e[:3] for e in manifest["extents"]])
+
+    if incremental:
+        store_manifest(out_path, baseline, extents)
+    return written
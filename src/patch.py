@@ -0,0 +1,113 @@
+import os
+import zlib
+import struct
+
+import cache
+import output
+
+PATCH_MAGIC = b"GDCP"
+PATCH_VERSION = 1
+#magic, version, flags, baseline md5, baseline size, extent count
+PATCH_HEADER = struct.Struct("<4sII16sQI")
+#offset, length, followed by length bytes of data
+PATCH_EXTENT = struct.Struct("<QI")
+PATCH_COMPRESSED = 1
+
+READ_CHUNK = 1024 * 1024
+
+class PatchError(Exception):
+    pass
+
+def write_patch(patch_path, extents, baseline, baseline_size, compress=False):
+    #Writes the extents as a patch for the original with the given md5 and size. Only the header
+    #is stored uncompressed. Returns the size of the patch file.
+    out_dir = os.path.dirname(patch_path)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    compressor = zlib.compressobj() if compress else None
+    with open(patch_path, "wb") as f:
+        f.write(PATCH_HEADER.pack(PATCH_MAGIC, PATCH_VERSION, PATCH_COMPRESSED if compress else 0,
+            bytes.fromhex(baseline), baseline_size, len(extents)))
+
+        for start, end, owner, data in extents:
+            for chunk in (PATCH_EXTENT.pack(start, end - start), data):
+                f.write(compressor.compress(chunk) if compressor else chunk)
+
+        if compressor:
+            f.write(compressor.flush())
+
+        return f.tell()
+
+class PatchReader:
+    #Reads the body of a patch file in exact sized pieces, decompressing it as it goes.
+    def __init__(self, f, compressed):
+        self.f = f
+        self.decompressor = zlib.decompressobj() if compressed else None
+        self.buffer = bytearray()
+
+    def fill(self):
+        if self.decompressor and self.decompressor.unconsumed_tail:
+            chunk = self.decompressor.unconsumed_tail
+        else:
+            chunk = self.f.read(READ_CHUNK)
+            if not chunk:
+                raise PatchError("Patch file is truncated")
+
+        #Limited so a highly compressed patch can't inflate into memory all at once.
+        try:
+            self.buffer += self.decompressor.decompress(chunk, READ_CHUNK) if self.decompressor else chunk
+        except zlib.error:
+            raise PatchError("Patch file is corrupt")
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            self.fill()
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def finish(self):
+        #zlib only verifies the checksum at the end of the stream, so the rest is read after the
+        #last extent. Nothing may follow the last extent.
+        if self.decompressor:
+            while not self.decompressor.eof and not self.buffer:
+                self.fill()
+            if self.decompressor.unused_data:
+                raise PatchError("Patch file is corrupt")
+        if self.buffer or self.f.read(1):
+            raise PatchError("Patch file is corrupt")
+
+def apply_patch(patch_path, original_path, out_path):
+    #Writes the original with the patch applied to out_path. The patch is streamed, so only one
+    #extent is held in memory at a time. Returns the number of extents applied.
+    with open(patch_path, "rb") as f:
+        header = f.read(PATCH_HEADER.size)
+        if len(header) < PATCH_HEADER.size:
+            raise PatchError("Not a patch file")
+
+        magic, version, flags, baseline, baseline_size, count = PATCH_HEADER.unpack(header)
+        if magic != PATCH_MAGIC or version != PATCH_VERSION:
+            raise PatchError("Not a patch file or unsupported version")
+
+        if os.path.getsize(original_path) != baseline_size or cache.file_hash(original_path) != baseline.hex():
+            raise PatchError("The patch was made for a different original, its md5 is %s" % baseline.hex())
+
+        output.write_patched(original_path, out_path, read_extents(PatchReader(f, flags & PATCH_COMPRESSED),
+            count, baseline_size))
+
+    return count
+
+def read_extents(reader, count, size):
+    #Yields the extents in the same form as diff.Extents, they must be sorted and inside the original.
+    position = 0
+    for i in range(count):
+        start, length = PATCH_EXTENT.unpack(reader.read(PATCH_EXTENT.size))
+        if start < position or start + length > size:
+            raise PatchError("Patch extents are out of order or outside the original")
+
+        position = start + length
+        yield start, position, None, reader.read(length)
+
+    reader.finish()
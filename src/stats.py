@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from deca import jit
+
+try:
+    import resource
+except ImportError:
+    #Not available on Windows, disk reads and RSS aren't reported there.
+    resource = None
+
+#Writes the JSON report to this path, same as --stats.
+STATS_ENV = "MODMERGER_STATS"
+
+def cpu_time():
+    #This process and its finished children, which includes the diff workers once the pool is shut down.
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def disk_read():
+    #Bytes actually read from disk, the files are mostly mapped so page cache hits aren't counted.
+    if resource is None:
+        return None
+    blocks = resource.getrusage(resource.RUSAGE_SELF).ru_inblock + resource.getrusage(resource.RUSAGE_CHILDREN).ru_inblock
+    return blocks * 512
+
+def max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def timed(function, *args):
+    #Also returns the wall and CPU time of the call, module level so it can run in a diff worker.
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = function(*args)
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+class Stats:
+    #Wall and CPU time, disk reads and peak memory of each stage of a merge, and timings of each
+    #mod. Peak memory is only measured while tracemalloc is tracing, which slows everything down.
+    def __init__(self):
+        self.stages = {}
+        self.mods = {}
+
+    @contextmanager
+    def stage(self, name):
+        #A stage that runs more than once adds up.
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = cpu_time()
+        read = disk_read()
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "disk_read": None, "peak_memory": None})
+            record["wall"] += time.perf_counter() - wall
+            record["cpu"] += cpu_time() - cpu
+            if read is not None:
+                record["disk_read"] = (record["disk_read"] or 0) + disk_read() - read
+            if tracemalloc.is_tracing():
+                record["peak_memory"] = max(record["peak_memory"] or 0, tracemalloc.get_traced_memory()[1])
+            record["max_rss"] = max_rss()
+
+    def mod(self, path, **values):
+        self.mods.setdefault(path, {}).update(values)
+
+    def summary(self):
+        #Single line for the status bar.
+        total = sum(record["wall"] for record in self.stages.values())
+        stages = ", ".join("%s %.2f s" % (name, record["wall"]) for name, record in self.stages.items())
+        return "%.2f s (%s)" % (total, stages)
+
+    def write_report(self, path):
+        report = {
+            "time": time.time(),
+            "mod_count": len(self.mods),
+            "mod_bytes": sum(mod.get("size", 0) for mod in self.mods.values()),
+            "max_rss": max_rss(),
+            "jit_backend": jit.backend,
+            "stages": self.stages,
+            "mods": self.mods,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,119 @@
+import os
+import struct
+import ctypes
+import ctypes.util
+
+WATCH_INTERVAL = 0.5
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+#Same as O_NONBLOCK, which os doesn't have on Windows where this module must still import.
+IN_NONBLOCK = getattr(os, "O_NONBLOCK", 0o4000)
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+#wd, mask, cookie, name length, followed by the name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+def normalize(path):
+    return path.replace("\\", "/")
+
+class PollWatcher:
+    #Finds changes by comparing the size and mtime of every file under root between polls.
+    def __init__(self, root):
+        self.root = root
+        self.files = self.scan()
+
+    def scan(self):
+        files = {}
+        for root, dirs, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[normalize(path)] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def poll(self):
+        #Paths of the files added, changed or removed since the last poll.
+        files = self.scan()
+        changed = set(files.items()) ^ set(self.files.items())
+        self.files = files
+        return set(path for path, identity in changed)
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    #Linux only, the kernel reports the changes so nothing is scanned between polls. Every
+    #directory needs its own watch, new directories are watched as they appear.
+    def __init__(self, root, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.watches = {}
+        self.root = root
+        self.add_tree(root)
+
+    def add_tree(self, path):
+        for root, dirs, names in os.walk(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = root
+
+    def poll(self):
+        #Paths of the files and directories added, changed or removed since the last poll, or None
+        #if the kernel dropped events and everything has to be rescanned.
+        changed = set()
+        while True:
+            try:
+                events = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            position = 0
+            while position < len(events):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(events, position)
+                name = events[position + INOTIFY_EVENT.size:position + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                position += INOTIFY_EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches or not name:
+                    continue
+
+                path = os.path.join(self.watches[wd], os.fsdecode(name))
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                changed.add(normalize(path))
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def create_watcher(root):
+    #inotify where the C library has it, polling everywhere else.
+    libc_name = ctypes.util.find_library("c")
+    if libc_name:
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            if hasattr(libc, "inotify_init1"):
+                return InotifyWatcher(root, libc)
+        except OSError:
+            pass
+    return PollWatcher(root)